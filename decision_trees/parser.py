@@ -2,8 +2,55 @@
 """
 The parser module for parsing the Weka ARFF format.
 """
-import collections
+import io
+import itertools
 import re
+import sys
+
+import numpy as np
+
+
+_KEYWORDS = ('IF', 'THEN', 'ENDIF', 'NEXT', 'GOSUB', 'RETURN')
+# A string, ok with '-' and '–' as well as $, <, >, =, _ (\w)
+# Written so that every string has exactly one way of matching, avoiding
+# backtracking between the nested quantifiers
+_STRING = r'[\w$<>=]+(?:[-–][\w$<>=]+)*'
+_TOKEN_SPECIFICATION = [
+    ('RELATION_DECL', r'@relation'),        # Relation declaration
+] + [
+    # Keywords are upper case only and must not be the start of a longer
+    # string, hence the case sensitive group and the lookahead
+    (keyword, r'(?-i:%s)(?![\w$<>=–-])' % keyword) for keyword in _KEYWORDS
+] + [
+    ('STRING', _STRING),
+    ('ATTR_DECL', r'@attribute'),           # Attribute declaration
+    # Numeric datatypes; numeric, integer, real: treated same
+    ('NUM_DATATYPE', r'numeric|integer|real'),
+    ('LEFT_CURLY', r'{'),                   # Match '{'
+    ('RIGHT_CURLY', r'}'),                  # Match '}'
+    ('COMMA', r','),                         # Match ','
+    # date and relational are left out of this impl for now
+
+    ('DATA_DECL', r'@data'),                # Data declaration
+    ('MISSING_DECL', r'\?'),                # For missing values
+
+    ('NUMBER', r'\d+(?:\.\d+)?'),           # Integer or decimal number
+]
+# One-line comments, line endings, spaces and tabs produce no tokens. They
+# are consumed as an unnamed prefix of every match so that each match found
+# by the regex engine is a token. A comment must run to the end of the line,
+# otherwise backtracking could hand the tail of a comment back as a token.
+_SKIP = r'(?:%.*(?!.)|[ \t\n])*'
+# Compiled once at import time rather than on every call to tokenize
+_SKIP_REGEX = re.compile(_SKIP)
+_TOK_REGEX = re.compile(
+    _SKIP + '(?:' +
+    '|'.join('(?P<%s>%s)' % pair for pair in _TOKEN_SPECIFICATION) + ')',
+    re.IGNORECASE)
+# One example in the data section, i.e. comma separated strings or '?' for
+# missing values
+_EXAMPLE_REGEX = re.compile(
+    r'{0}(?:[ \t]*,[ \t]*{0})*'.format(r'(?:%s|\?)' % _STRING))
 
 
 def parse(file):
@@ -12,69 +59,94 @@ def parse(file):
     returns a Data representation of the source file.
     """
     with open(file, 'r') as f:
-        s = f.read()
-        parser = Parser(Lexer.tokenize(s))
+        lines = Lexer.Lines(f)
+        parser = Parser(Lexer.tokenize_stream(lines), lines=lines)
         return parser.parse()
 
 
 class Lexer:
     """
     The lexer (a.k.a scanner) is reponsible for tokenising the
-    input string.
-    At this moment it works by accepting a string with the contents
-    to be tokenised; the entire source file. In general this should probably
-    not done that way. Instead lazily reading the file probably...
-    However, the output is at lazy in the form of a generator
+    input. It either accepts a string with the contents to be tokenised,
+    or reads lazily line by line from a file. The output is lazy as well,
+    in the form of a generator.
     """
-    Token = collections.namedtuple('Token', ['typ', 'value', 'line', 'column'])
+
+    class Token:
+        """
+        A single token. A plain class with __slots__ rather than a
+        namedtuple, as it is cheaper to construct and one is created for
+        every lexeme in the source.
+        """
+        __slots__ = ('typ', 'value', 'line', 'column')
+
+        def __init__(self, typ, value, line, column):
+            self.typ = typ
+            self.value = value
+            self.line = line
+            self.column = column
+
+        def __repr__(self):
+            return 'Token(typ={!r}, value={!r}, line={}, column={})'.format(
+                self.typ, self.value, self.line, self.column)
+
+    class Lines:
+        """
+        An iterator over lines (e.g. an open file) that remembers the last
+        line read. Tokenising it lets a Parser read the data section from
+        the remaining lines, starting with the rest of the @data line.
+        """
+        __slots__ = ('lines', 'current')
+
+        def __init__(self, lines):
+            self.lines = iter(lines)
+            self.current = None
+
+        def __iter__(self):
+            return self
+
+        def __next__(self):
+            self.current = next(self.lines)
+            return self.current
 
     def tokenize(s):
         """
         Returns a generator yielding tokens as long as any are available from
         the string s.
         """
-        keywords = {'IF', 'THEN', 'ENDIF', 'NEXT', 'GOSUB', 'RETURN'}
-        token_specification = [
-            ('COMMENT', r'%.*'),                    # One-line comment
-            ('RELATION_DECL', r'@relation'),        # Relation declaration
-            # A string, ok with '-' and '–' as well as $, <, >, =, _ (\w)
-            ('STRING', r'[\w$<>=]+(?:[-–]?[\w$<>=]+)*'),
-            ('ATTR_DECL', r'@attribute'),           # Attribute declaration
-            # Numeric datatypes; numeric, integer, real: treated same
-            ('NUM_DATATYPE', r'numeric|integer|real'),
-            ('LEFT_CURLY', r'{'),                   # Match '{'
-            ('RIGHT_CURLY', r'}'),                  # Match '}'
-            ('COMMA', r','),                         # Match ','
-            # date and relational are left out of this impl for now
-
-            ('DATA_DECL', r'@data'),                # Data declaration
-            ('MISSING_DECL', r'\?'),                # For missing values
-
-            ('NUMBER', r'\d+(?:\.?\d+)?'),          # Integer or decimal number
-            ('NEWLINE', r'[\n]'),                   # Line endings
-            ('SKIP', r'[ \t]'),                     # Skip over spaces and tabs
-        ]
-        tok_regex = '|'.join(
-            '(?P<%s>%s)' % pair for pair in token_specification)
-        get_token = re.compile(tok_regex, re.IGNORECASE).match
-        line = 1
-        pos = line_start = 0
-        mo = get_token(s)
-        while mo is not None:
-            typ = mo.lastgroup
-            if typ == 'NEWLINE':
-                line_start = pos
-                line += 1
-            elif typ != 'SKIP' and typ != 'COMMENT':
-                val = mo.group(typ)
-                if typ == 'STRING' and val in keywords:
-                    typ = val
-                yield Lexer.Token(typ, val, line, mo.start() - line_start)
-            pos = mo.end()
-            mo = get_token(s, pos)
-        if pos != len(s):
-            raise RuntimeError('Unexpected character %r on line %d' %
-                               (s[pos], line))
+        return Lexer.tokenize_stream(io.StringIO(s))
+
+    def tokenize_stream(lines):
+        """
+        Returns a generator yielding tokens from an iterable of lines, e.g.
+        an open file. No token spans a line, so each line is tokenised on its
+        own and only the current line needs to be held in memory.
+        """
+        # Look up everything used per token once, outside the loop
+        token = Lexer.Token
+        intern = sys.intern
+        match = _TOK_REGEX.match
+        skip = _SKIP_REGEX.match
+        for line, s in enumerate(lines, 1):
+            pos = 0
+            # Each token is matched where the previous one ended. A search
+            # (e.g. finditer) would retry the failed match at every later
+            # position, and as the skip prefix swallows the rest of a line
+            # before failing, trailing whitespace would take quadratic time.
+            mo = match(s)
+            while mo is not None:
+                typ = mo.lastgroup
+                # Values are interned: the same few attribute names and
+                # nominal values recur throughout a file, and interned
+                # strings share one object and compare equal by identity
+                yield token(typ, intern(mo.group(typ)), line, mo.start(typ))
+                pos = mo.end()
+                mo = match(s, pos)
+            # Only comments and whitespace may follow the last token
+            end = skip(s, pos).end()
+            if end != len(s):
+                raise RuntimeError('Unexpected character %r on line %d' %
+                                   (s[end], line))
 
 
 class Parser:
@@ -83,8 +155,19 @@ class Parser:
     Currently only nominal datatypes for the attributes are supported.
     """
 
-    def __init__(self, token_generator):
+    def __init__(self, token_generator, lines=None):
+        """
+        :param token_generator: the tokens to parse, from the Lexer
+        :param lines: optionally the Lexer.Lines the tokens are read from,
+            i.e. the same object token_generator was made from by
+            Lexer.tokenize_stream. If given, the data section is read
+            directly from the remaining lines instead of being tokenised.
+        """
+        if lines is not None and not isinstance(lines, Lexer.Lines):
+            raise TypeError("lines must be the Lexer.Lines the tokens are "
+                            "read from")
         self.token_generator = token_generator
+        self.lines = lines
         self.current_token = None
 
     def accept(self, token_type):
@@ -93,7 +176,6 @@ class Parser:
                 "Cannot acccept {}, current_token: {}".format(
                     token_type, self.current_token))
         else:
-            # print("\nAccept {}".format(self.current_token))
             t = self.current_token
             self.next_token()
             return t
@@ -119,9 +201,13 @@ class Parser:
 
         # Expecting a number of @attribute <name> <datatype>
         self.attributes = self.attributes()
+        # Fixed for all examples, so only turned into a tuple once
+        self.attr_names = tuple(self.attributes)
 
         # Expecting data section
-        if self.expect('DATA_DECL'):
+        if self.expect('DATA_DECL') and self.lines is not None:
+            data = self.data_lines()
+        elif self.expect('DATA_DECL'):
             data = self.data()
         else:
             raise RuntimeError('No DATA section found!')
@@ -132,20 +218,18 @@ class Parser:
         """
         Parse attribute decl lines, e.g. @attribute <name> <datatype>
         """
-        dict = collections.OrderedDict()
+        attributes = {}
         while self.expect('ATTR_DECL'):
             self.accept('ATTR_DECL')
             attr_name = self.accept('STRING')
-            # print("@attribute {}".format(attr_name.value))
             if self.expect('NUM_DATATYPE'):
-                data_type = self.accept('NUM_DATATYPE')
-                # print("datatype is {}".format(data_type.value))
+                self.accept('NUM_DATATYPE')
             elif self.expect('LEFT_CURLY'):
                 self.accept('LEFT_CURLY')
-                dict[attr_name.value] = self.nominal_values()
+                attributes[attr_name.value] = self.nominal_values()
             else:
                 raise RuntimeError('Not implemented', self.current_token)
-        return dict
+        return attributes
 
     def nominal_values(self):
         """
@@ -166,34 +250,95 @@ class Parser:
 
     def data(self):
         """
-        Parse the data section. Return a list of OrderedDicts,
-        one dict per example of the form 'attr1' : 'val1' etc.
+        Parse the data section. Return a list of dicts (which preserve
+        the attribute order), one dict per example of the form 'attr1' : 'val1' etc.
+        Missing values, given as '?', are None.
+
+        The data section makes up almost all of a typical file, so rather
+        than going through accept/expect for every token it is parsed by a
+        single loop over the remaining tokens. A STRING directly following
+        another STRING (i.e. not separated by a COMMA) starts a new example.
         """
         self.accept('DATA_DECL')
 
         # loop through the whole data section
         examples = []   # list for all examples
-        while self.expect('STRING'):
-
-            # iterator for the attribute names
-            attr_iter = iter(self.attributes)
-
-            # ordered dictionary for one example
-            example = collections.OrderedDict()
-            data1 = self.accept('STRING')
-            attr_name = next(attr_iter)
-            example[attr_name] = data1.value
-            # one line
-            while self.expect('COMMA'):
-                self.accept('COMMA')
-                data = self.accept('STRING')
-                attr_name = next(attr_iter)
-                example[attr_name] = data.value
+        values = []     # values of the current example
+        after_comma = False
+        token = self.current_token
+        while token is not None:
+            typ = token.typ
+            if typ == 'STRING' or typ == 'MISSING_DECL':
+                if values and not after_comma:
+                    examples.append(self.example(values))
+                    values = []
+                values.append(token.value if typ == 'STRING' else None)
+                after_comma = False
+            elif token.typ == 'COMMA' and values and not after_comma:
+                after_comma = True
+            else:
+                raise RuntimeError(
+                    "Unexpected token in data section: {}".format(token))
+            token = next(self.token_generator, None)
+        self.current_token = None
 
-            examples.append(example)
+        if after_comma:
+            raise RuntimeError("Data section ends with a ','")
+        if values:
+            examples.append(self.example(values))
+        return examples
 
+    def data_lines(self):
+        """
+        Parse the data section straight from the remaining source lines.
+        The data section is plain comma separated values, so there is no
+        need to run the lexer over every value and comma; each line is
+        checked against a single regex and then split. Missing values,
+        given as '?', are None.
+        Expecting that when this method called, current_token is the
+        DATA_DECL and the lexer has not read past its line.
+        """
+        decl = self.current_token
+        current = self.lines.current
+        if current is None or not current.startswith(decl.value,
+                                                     decl.column):
+            raise RuntimeError("The lines given are not the ones the tokens "
+                               "were read from")
+        intern = sys.intern
+        line = decl.line - 1
+        examples = []
+        # The lexer stopped at @data, so the rest of its line comes first.
+        # The remaining lines are read past the Lines wrapper, as nothing
+        # needs to know the current line any more.
+        rest = current[decl.column + len(decl.value):]
+        for s in itertools.chain((rest,), self.lines.lines):
+            line += 1
+            s = s.partition('%')[0].strip()
+            if not s:
+                continue
+            if _EXAMPLE_REGEX.fullmatch(s) is None:
+                raise RuntimeError(
+                    "Malformed example on line {}: {!r}".format(line, s))
+            values = [v.strip() for v in s.split(',')]
+            examples.append(self.example(
+                [None if v == '?' else intern(v) for v in values]))
+        self.current_token = None
         return examples
 
+    def example(self, values):
+        """
+        Build one example from the values of a line in the data section.
+        """
+        attr_names = self.attr_names
+        if len(values) != len(attr_names):
+            raise RuntimeError(
+                "Expected {} values in example, got {}".format(
+                    len(attr_names), values))
+        # Built in one go from the collected values rather than one
+        # assignment per attribute; benchmarked faster than both a dict
+        # comprehension and updating a copy of a pre-sized template dict
+        return dict(zip(attr_names, values))
+
 
 class Data:
     """
@@ -207,18 +352,48 @@ class Data:
         # where each example is a dictionary of the
         # form { attribute1: val1, attribute2: val2,... }
         self.examples = data
+        self._columns = None
+
+    def columns(self):
+        """
+        The examples as integer coded columns (a structure of arrays rather
+        than the list of dictionaries in self.examples).
+        Returns a pair (columns, categories), where columns maps each
+        attribute to an array holding, for every example, the index of its
+        value in categories[attr]. The categories of an attribute are its
+        declared nominal values followed by any other values found in the
+        examples (including None, for missing values), in order of
+        appearance.
+        They are worked out on the first call and the same ones are returned
+        from then on, so they are not to be modified.
+        """
+        if self._columns is not None:
+            return self._columns
+        columns = {}
+        categories = {}
+        for attr, values in self.attributes.items():
+            values = list(values)
+            codes = {v: i for i, v in enumerate(values)}
+            column = []
+            for e in self.examples:
+                v = e[attr]
+                if v not in codes:
+                    codes[v] = len(values)
+                    values.append(v)
+                column.append(codes[v])
+            columns[attr] = np.array(column, dtype=np.intp)
+            columns[attr].flags.writeable = False
+            categories[attr] = values
+        self._columns = columns, categories
+        return self._columns
 
     def __str__(self):
-        def data_string():
-            string = ""
-            for ex in self.examples:
-                string += str(ex) + "\n"
-            return string
+        data_string = "".join(str(ex) + "\n" for ex in self.examples)
 
         return "Relation: {}\nAttributes: {}\nData:\n{}".format(
             str(self.relation),
             str(self.attributes),
-            data_string())
+            data_string)
 
 
 if __name__ == '__main__':
@@ -3,22 +3,57 @@ Module containing decision tree induction.
 """
 import sys
 import os
+import types
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 
 from collections import Counter
+import numpy as np
 from numpy import log2
 from math import log
-from scipy.stats import chisquare
+from scipy.special import chdtrc, xlogy
 
 
 # The confidence level to be used when pruning
 CUTOFF = 0.05
 
+# The number of levels of a tree compile_eval nests in one function
+COMPILE_DEPTH = 20
+
+# Importances closer than this are ties, which go to the first attribute
+TIE_TOLERANCE = 1e-9
+
+# The classifications of a boolean classification problem. The parser interns
+# every value it reads, so examples compare equal to these by identity.
+YES = sys.intern("Yes")
+NO = sys.intern("No")
+
+
+def _intern(s):
+    """
+    Interns s if it is a str (sys.intern does not take subclasses, such as
+    numpy.str_), otherwise returns it as it is.
+    """
+    return sys.intern(s) if type(s) is str else s
+
 
 def get_attribute_values(attr: str, examples: list):
     return set([e[attr] for e in examples])
 
 
+def partition(attr: str, examples: list):
+    """
+    Groups examples by their value of an attribute, in a single pass.
+
+    :param attr: the attribute to group by
+    :param examples: list of dictionaries with examples as entries
+    :return: dict mapping each value of attr to the examples having it
+    """
+    groups = {}
+    for e in examples:
+        groups.setdefault(e[attr], []).append(e)
+    return groups
+
+
 def plurality_value(examples: list):
     """
     Returns the most common classification in a list of examples.
@@ -27,17 +62,17 @@ def plurality_value(examples: list):
         contain the key "classification"
     :return: str, most common classification
     """
-    return Counter([e["classification"] for e in examples]).most_common(1)[0][0]
+    counts = Counter(e["classification"] for e in examples)
+    # max returns the first most common one, just like most_common(1)
+    return max(counts, key=counts.__getitem__)
 
 
 def examples_have_same_classification(examples: list):
-    if len(examples) == 1:
+    if not examples:
         return True
-    else:
-        for a in examples[1:]:
-            if a["classification"] != examples[0]["classification"]:
-                return False
-    return True
+    c = examples[0]["classification"]
+    # stops at the first differing example, without copying the list
+    return all(e["classification"] == c for e in examples)
 
 
 def basic_importance(attr: str, examples: list):
@@ -49,60 +84,179 @@ def B(q):
     Binary entropy function for boolean values.
     q = 0.5 returns the maximum of 1
     q = 0 and q = 1 returns the minimum values of 0
-    :param q: Boolean variable positive probability
+    :param q: Boolean variable positive probability, or an array of them
     :return: entropy
     """
-    if q == 0 or q == 1:
-        return 0
-    return -(q * log2(q) + (1 - q) * log2(1 - q))
+    # xlogy(0, 0) is 0, so q = 0 and q = 1 need no special case
+    return -(xlogy(q, q) + xlogy(1 - q, 1 - q)) / log(2)
 
 
 def entropy_importance(attr: str, examples: list):
-    p = len([1 for e in examples if e["classification"] == "Yes"])
-    n = len([1 for e in examples if e["classification"] == "No"])
+    return information_gain(tabulate(attr, examples, [YES, NO]))
 
-    remainder = 0
-    for d in get_attribute_values(attr, examples):
-        subset = [e for e in examples if e[attr] == d]
-        pk = len([1 for e in subset if e["classification"] == "Yes"])
-        nk = len([1 for e in subset if e["classification"] == "No"])
-        remainder += (pk + nk) / (p + n) * B(pk / (pk + nk))
 
-    return B(p / (p + n)) - remainder
+def entropy(counts):
+    """
+    Entropy (in bits) of the distributions given by counts. If counts is
+    two dimensional, returns the entropy of every row.
+    :param counts: array with the number of examples of each class
+    :return: entropy
+    """
+    counts = np.asarray(counts, dtype=float)
+    totals = counts.sum(axis=-1, keepdims=True)
+    p = counts / np.where(totals == 0, 1, totals)
+    # 0 * log2(0) is taken to be 0
+    return -(p * np.log2(np.where(p == 0, 1, p))).sum(axis=-1)
 
 
-def generalised_B(q, b):
-    if q == 0 or q == 1:
-        return 0
-    return -q * log(q, b)
+def gini_importance(attr: str, examples: list):
+    """
+    Reduction in Gini impurity from splitting on an attribute. Like
+    entropy_importance, but needs no logarithms.
+    """
+    counts = tabulate(attr, examples, [YES, NO])
+    weights = counts.sum(axis=1) / counts.sum()
+    return gini(counts.sum(axis=0)) - (weights * gini(counts)).sum()
 
 
-def generalised_entropy_importance(attr: str, examples: list, classes: list):
-    outcomes = [
-        len([1 for e in examples if e["classification"] == c])
-        for c in classes
-    ]
-    total_entropy = sum([
-        generalised_B(p / len(examples), b=len(classes))
-        for p in outcomes
-    ])
+def gini(counts):
+    """
+    Gini impurity of the distributions given by counts, i.e. the chance
+    that two examples drawn at random have different classes. If counts is
+    two dimensional, returns the impurity of every row.
+    :param counts: array with the number of examples of each class
+    :return: Gini impurity
+    """
+    counts = np.asarray(counts, dtype=float)
+    totals = counts.sum(axis=-1)
+    totals = np.where(totals == 0, 1, totals)
+    return 1 - (counts ** 2).sum(axis=-1) / totals ** 2
 
-    remainder = 0
-    for d in get_attribute_values(attr, examples):
-        subset = [e for e in examples if e[attr] == d]
 
-        outcomes_k = [
-            len([1 for e in subset if e["classification"] == c])
-            for c in classes
-        ]
+def remainder(counts):
+    """
+    Expected entropy remaining after splitting on an attribute.
+    :param counts: contingency table with one row per attribute value and
+        one column per class, holding the number of examples of each
+    :return: entropy of each subset weighted by its size
+    """
+    counts = np.asarray(counts)
+    return (counts.sum(axis=1) / counts.sum() * entropy(counts)).sum()
+
+
+def information_gain(counts):
+    """
+    Information gain of splitting on an attribute.
+    :param counts: contingency table with one row per attribute value and
+        one column per class, holding the number of examples of each
+    :return: expected reduction in entropy
+    """
+    counts = np.asarray(counts)
+    return entropy(counts.sum(axis=0)) - remainder(counts)
 
-        remainder += sum([
-            sum(outcomes_k) / sum(outcomes) *
-            generalised_B(pk / sum(outcomes_k), b=len(classes))
-            for pk in outcomes_k
-        ])
 
-    return total_entropy - remainder
+def tabulate(attr: str, examples: list, classes: list):
+    """
+    Contingency table of the values of an attribute against the
+    classifications, counted in a single pass over the examples. Examples
+    with a classification not among classes are not counted.
+
+    :param attr: the attribute
+    :param examples: list of dictionaries with examples as entries
+    :param classes: list of the classifications to count
+    :return: array with one row per value of attr, in order of appearance,
+        and one column per class
+    """
+    class_codes = {c: i for i, c in enumerate(classes)}
+    # Counted straight into the rows of the table, in the same pass that
+    # reads the examples, for both the per-value counts and (by summing the
+    # rows) the class totals
+    rows = {}
+    for e in examples:
+        c = class_codes.get(e["classification"])
+        if c is not None:
+            row = rows.get(e[attr])
+            if row is None:
+                row = rows[e[attr]] = [0] * len(classes)
+            row[c] += 1
+    return np.array(list(rows.values()), dtype=np.intp).reshape(
+        -1, len(classes))
+
+
+def xlog2x_table(n):
+    """
+    Lookup table of k * log2(k) for the counts k = 0, 1, ..., n, so that
+    entropies of counts need no logarithms (0 * log2(0) is taken to be 0).
+    :param n: the largest count
+    :return: array of length n + 1
+    """
+    k = np.arange(n + 1, dtype=float)
+    k[0] = 1
+    table = k * np.log2(k)
+    table[0] = 0
+    return table
+
+
+def best_split(X, y, idx, candidates, n_values, n_classes, xlog2x):
+    """
+    Finds the attribute with the largest information gain at a node.
+
+    :param X: integer coded examples, one row per example and one column per
+        attribute
+    :param y: integer coded classifications of the examples
+    :param idx: indices of the examples at the node
+    :param candidates: bitmask of the attributes to consider, bit a set
+        for column a
+    :param n_values: number of possible values of each attribute (column)
+    :param n_classes: number of possible classes
+    :param xlog2x: xlog2x_table of at least len(idx)
+    :return: tuple of the column index of the best attribute and its
+        contingency table
+    """
+    cols = [a for a in range(len(n_values)) if candidates >> a & 1]
+    # The values of all the candidates are numbered one after the other, so
+    # that a single count over the node's examples gives the contingency
+    # tables of every candidate, stacked
+    sizes = np.array([n_values[a] for a in cols])
+    starts = np.cumsum(sizes) - sizes
+    # Worked out in place, as for a large node these are big arrays; the
+    # codes are widened from their narrow type first
+    codes = X[idx][:, cols].astype(np.intp)
+    codes += starts
+    codes *= n_classes
+    codes += y[idx, np.newaxis]
+    # the order the codes are counted in does not matter, so they are
+    # flattened in whatever order avoids a copy
+    tables = np.bincount(codes.ravel(order='K'),
+                         minlength=sizes.sum() * n_classes).reshape(
+                             -1, n_classes)
+    # The entropy before the split is the same whichever attribute is
+    # chosen, so the largest information gain is the smallest remainder.
+    # With N examples, n of a value and c of a class among those, the
+    # remainder is the sum over the values of n * log2(n) - sum(c *
+    # log2(c)), divided by N. Taken per value, so that a pure subset counts
+    # as exactly 0.
+    per_value = xlog2x[tables.sum(axis=1)] - xlog2x[tables].sum(axis=1)
+    remainders = np.add.reduceat(per_value, starts) / len(idx)
+    # Remainders equal up to rounding are ties, won by the first attribute,
+    # by the same rule as in decision_tree_learning
+    best = 0
+    for k in range(1, len(remainders)):
+        if remainders[k] < remainders[best] - TIE_TOLERANCE:
+            best = k
+    return cols[best], tables[starts[best]:starts[best] + sizes[best]]
+
+
+def generalised_B(q, b):
+    return -xlogy(q, q) / log(b)
+
+
+def generalised_entropy_importance(attr: str, examples: list, classes: list):
+    if len(classes) < 2:
+        return 0
+    # entropy is in bits, rescaled to be in base len(classes)
+    return information_gain(tabulate(attr, examples, classes)) / \
+        log2(len(classes))
 
 
 def should_prune(attr, examples):
@@ -114,51 +268,58 @@ def should_prune(attr, examples):
     :param examples: the data
     :return: to prune or not to prune
     """
-    p = len([1 for e in examples if e["classification"] == "Yes"])
-    n = len([1 for e in examples if e["classification"] == "No"])
-    obs = []
-    exp = []
-    delta = 0
-    attrs = get_attribute_values(attr, examples)
-    for d in attrs:
-        subset = [e for e in examples if e[attr] == d]
-        pk = len([1 for e in subset if e["classification"] == "Yes"])
-        nk = len([1 for e in subset if e["classification"] == "No"])
-        pk_hat = p * (pk + nk)/(p + n)
-        nk_hat = n * (pk + nk)/(p + n)
-        obs.append(pk)
-        exp.append(pk_hat)
-        obs.append(nk)
-        exp.append(nk_hat)
-        delta += ((pk - pk_hat)**2) / pk_hat + ((nk - nk_hat)**2) / nk_hat
-
-    chi2, p = chisquare(obs, f_exp=exp, ddof=len(attrs) - 1)
-    # print("should_prune {} Δ: {} \u03C7\u00B2: {}, p: {}".format(attr, delta, chi2, p))
+    table = tabulate(attr, examples, [YES, NO])
+    # The counts expected if attr were irrelevant, i.e. if every subset had
+    # the same proportion of each class as the examples as a whole
+    expected = np.outer(table.sum(axis=1), table.sum(axis=0)) / table.sum()
+    # A class no example has is expected 0 times and observed 0 times, so
+    # its cells add nothing (rather than 0 / 0)
+    delta = np.divide((table - expected) ** 2, expected,
+                      out=np.zeros_like(expected), where=expected > 0).sum()
+    # The p-value of delta, with one degree of freedom per attribute value
+    # (the 2 * values observations less the values - 1 "ddof" the test
+    # has always been run with)
+    p = chdtrc(len(table), delta)
     return p > CUTOFF
 
 
+class Leaf:
+    """
+    A leaf node of a DecisionTree, containing the classification to return.
+    """
+    __slots__ = ('value',)
+    is_leaf_node = True
+
+    def __init__(self, value):
+        self.value = value
+
+    def __str__(self):
+        return "Leaf node returns {}\n".format(self.value)
+
+
 class DecisionTree:
+    is_leaf_node = False
+
     def __init__(self, attr):
-        self.attr = attr
+        # Interned like the attribute names and values from the parser, so
+        # that looking them up in an example and in the branches compares
+        # the strings by identity
+        self.attr = _intern(attr)
         self.branches = dict()
-        self.is_leaf_node = False
-        self.value = None
 
     def add_branch(self, vk, subtree):
-        if isinstance(subtree, DecisionTree):
-            self.branches[vk] = subtree
-        else:
-            # Just add a dummy branch which is a leaf node and contains
-            # the required value
-            self.branches[vk] = DecisionTree(attr="Leaf")
-            self.branches[vk].is_leaf_node = True
-            self.branches[vk].value = subtree
+        # isinstance rather than an exact type check, so that subclasses of
+        # DecisionTree are kept as subtrees; this is not on a hot path
+        if not isinstance(subtree, (DecisionTree, Leaf)):
+            # A classification, which becomes a leaf node
+            subtree = Leaf(subtree)
+        self.branches[_intern(vk)] = subtree
 
     def eval(self, example: dict):
         # TODO: check that all required attributes (including those that occur
         # in all sub-branches) are found in the example
         tree = self
-        while not tree.is_leaf_node:
+        while type(tree) is not Leaf:
             try:
                 tree = tree.branches[example[tree.attr]]
             except KeyError:
@@ -166,6 +327,149 @@ class DecisionTree:
                                  "{}".format(example[tree.attr], tree.attr))
         return tree.value
 
+    def eval_batch(self, examples: list):
+        """
+        Classifies a list of examples. Instead of walking the tree once per
+        example, the examples are partitioned by their value of the
+        attribute at each node, so that each node is visited once.
+
+        :param examples: list of example dictionaries
+        :return: list of classifications, in the same order as examples
+        """
+        results = [None] * len(examples)
+        work = [(self, range(len(examples)))]
+        while work:
+            tree, idx = work.pop()
+            if type(tree) is Leaf:
+                for i in idx:
+                    results[i] = tree.value
+                continue
+            groups = {}
+            for i in idx:
+                groups.setdefault(examples[i][tree.attr], []).append(i)
+            for vk, group in groups.items():
+                try:
+                    work.append((tree.branches[vk], group))
+                except KeyError:
+                    raise ValueError("Value '{}' not found among branches "
+                                     "for {}".format(vk, tree.attr))
+        return results
+
+    def canonical(self):
+        """
+        The tree as nested tuples of its attribute and its branches, in
+        order, each a pair of the value and the classification or subtree.
+        Two trees are the same if their canonical forms are equal, which
+        compares them without formatting them as strings.
+        """
+        # Built bottom up with an explicit stack rather than by recursing, as
+        # trees can be deeper than the recursion limit. Each entry holds the
+        # value of the branch to a subtree, the subtree, an iterator over its
+        # branches and the pairs of those done so far.
+        stack = [(None, self, iter(self.branches.items()), [])]
+        while True:
+            vk, tree, branches, pairs = stack[-1]
+            for vk_, subtree in branches:
+                if type(subtree) is Leaf:
+                    pairs.append((vk_, subtree.value))
+                else:
+                    stack.append((vk_, subtree,
+                                  iter(subtree.branches.items()), []))
+                    break
+            else:
+                stack.pop()
+                if not stack:
+                    return (tree.attr, tuple(pairs))
+                stack[-1][3].append((vk, (tree.attr, tuple(pairs))))
+
+    def compile(self, categories: dict):
+        """
+        Packs the tree into flat arrays, for classifying integer coded
+        examples (see CompiledTree).
+
+        :param categories: dict mapping each attribute, and "classification",
+            to the list of its values, the code of a value being its index
+            (as returned by parser.Data.columns)
+        :return: CompiledTree
+        """
+        return CompiledTree(self, categories)
+
+    def compile_eval(self):
+        """
+        Generates a function doing the same as eval for this tree, with the
+        tree written out as nested if statements on the attribute values, so
+        that classifying an example follows no branches dictionaries.
+        Subtrees deeper than COMPILE_DEPTH levels are written out as
+        functions of their own, which the nested code returns to go on
+        with, so neither Python's limit on nesting nor the recursion limit
+        bounds the depth of the tree.
+        Later changes to the tree are not reflected in the function.
+
+        :return: function taking an example dictionary and returning its
+            classification
+        """
+        namespace = {"FunctionType": types.FunctionType}
+
+        def constant(x):
+            # Written as a literal if its repr is one, anything else (e.g. a
+            # numpy.str_) is passed in through the namespace
+            if x is None or type(x) in (str, int, bool):
+                return repr(x)
+            name = "c{}".format(len(namespace))
+            namespace[name] = x
+            return name
+
+        lines = []
+        functions = [(self, "node0")]
+        n_functions = 1
+        while functions:
+            tree, name = functions.pop()
+            lines.append("def {}(example):".format(name))
+            # Lines still to be written, and subtrees (with their depth in
+            # the function) still to be written out in their place
+            work = [(tree, 0)]
+            while work:
+                item = work.pop()
+                if type(item) is str:
+                    lines.append(item)
+                    continue
+                tree, depth = item
+                indent = "    " * (depth + 1)
+                value = "v{}".format(depth)
+                code = ["{}{} = example[{}]".format(indent, value,
+                                                    constant(tree.attr))]
+                keyword = "if"
+                for vk, subtree in tree.branches.items():
+                    code.append("{}{} {} == {}:".format(indent, keyword, value,
+                                                       constant(vk)))
+                    if type(subtree) is Leaf:
+                        code.append("{}    return {}".format(
+                            indent, constant(subtree.value)))
+                    elif depth + 1 < COMPILE_DEPTH:
+                        code.append((subtree, depth + 1))
+                    else:
+                        sub = "node{}".format(n_functions)
+                        n_functions += 1
+                        functions.append((subtree, sub))
+                        code.append("{}    return {}".format(indent, sub))
+                    keyword = "elif"
+                code.append("{}raise ValueError({!r}.format({}, {}))".format(
+                    indent, "Value '{}' not found among branches for {}",
+                    value, constant(tree.attr)))
+                work.extend(reversed(code))
+        split = n_functions > 1
+        if split:
+            # Classifications are never functions, so the walk goes on for
+            # as long as a function is returned
+            lines += ["def eval(example):",
+                      "    result = node0(example)",
+                      "    while type(result) is FunctionType:",
+                      "        result = result(example)",
+                      "    return result"]
+        exec(compile("\n".join(lines), "<DecisionTree>", "exec"), namespace)
+        # if the whole tree fits in node0, it needs no walk
+        return namespace["eval" if split else "node0"]
+
     def __str__(self):
         """
         Print the tree in an ascii format similar to the following:
@@ -180,8 +484,6 @@ class DecisionTree:
                     Attribute4 = value2: Yes
                 Attribute3 = value2: No
         """
-        if self.is_leaf_node:
-            return "Leaf node returns {}\n".format(self.value)
         s = ""
         tree = self
         for vk, subtree in tree.branches.items():
@@ -190,11 +492,84 @@ class DecisionTree:
         return s
 
 
+class CompiledTree:
+    """
+    A DecisionTree packed into flat arrays, which classifies integer coded
+    examples with array operations rather than by following dictionaries.
+
+    The nodes are numbered from 0, the root. For node i, node_attr[i] is the
+    index in attributes of the attribute it tests, or -1 for a leaf, whose
+    classification code is node_class[i] (-2 if the classification is not
+    among the categories, so that it matches no coded classification). The
+    child of an internal node for the value with code k is
+    child[offset[i] + k], or -1 if the tree has no branch for that value.
+    """
+
+    def __init__(self, tree: DecisionTree, categories: dict):
+        class_codes = {c: k for k, c in
+                       enumerate(categories["classification"])}
+        attr_index = {}
+        node_attr, node_class, offset, child = [], [], [], []
+        # Each entry holds a node still to be numbered and the slot in child
+        # that is to point at it (None for the root)
+        work = [(tree, None)]
+        while work:
+            node, slot = work.pop()
+            if slot is not None:
+                child[slot] = len(node_attr)
+            if type(node) is Leaf:
+                node_attr.append(-1)
+                node_class.append(class_codes.get(node.value, -2))
+                offset.append(0)
+                continue
+            if node.attr not in attr_index:
+                attr_index[node.attr] = len(attr_index)
+            node_attr.append(attr_index[node.attr])
+            node_class.append(-1)
+            offset.append(len(child))
+            codes = {v: k for k, v in enumerate(categories[node.attr])}
+            child.extend([-1] * len(codes))
+            for vk, subtree in node.branches.items():
+                # a branch for a value without a code can never be taken
+                if vk in codes:
+                    work.append((subtree, offset[-1] + codes[vk]))
+
+        self.attributes = list(attr_index)
+        self.node_attr = np.array(node_attr, dtype=np.intp)
+        self.node_class = np.array(node_class, dtype=np.intp)
+        self.offset = np.array(offset, dtype=np.intp)
+        self.child = np.array(child, dtype=np.intp)
+
+    def eval_batch(self, columns: dict):
+        """
+        Classifies integer coded examples. All of them are moved down the
+        tree together, one level per step.
+
+        :param columns: dict mapping each attribute to an array with the
+            code of its value in every example, coded by the same categories
+            as the tree was compiled with (as returned by parser.Data.columns)
+        :return: array with the code of the classification of every example,
+            -1 for those having a value the tree has no branch for and -2 for
+            those classified as something not among the categories
+        """
+        X = np.column_stack([columns[a] for a in self.attributes])
+        node = np.zeros(len(X), dtype=np.intp)
+        rows = np.arange(len(X))
+        while rows.size:
+            attr = self.node_attr[node[rows]]
+            internal = attr >= 0
+            rows, attr = rows[internal], attr[internal]
+            node[rows] = self.child[self.offset[node[rows]] + X[rows, attr]]
+            rows = rows[node[rows] >= 0]
+        return np.where(node >= 0, self.node_class[node], -1)
+
+
 def decision_tree_learning(examples: list, attributes: list, parent_examples,
                            importance_function: callable):
     """
     Decision tree learning algorithm as given in figure 18.5 in Artificial
-    Intelligence A Modern Approach.
+    Intelligence A Modern Approach. Attributes whose importances differ by no
+    more than TIE_TOLERANCE are ties, won by the one first in attributes.
 
     :param examples: list of dictionaries containing examples to learn from
     :param attributes: list of all attributes in the examples
@@ -205,79 +580,177 @@ def decision_tree_learning(examples: list, attributes: list, parent_examples,
         that attribute
     :return: DecisionTree, a decision tree
     """
-
+    # Only the root can be without examples, as partition never produces
+    # an empty subset, so parent_examples need not be passed further down
     if not examples:
         return plurality_value(parent_examples)
-    elif examples_have_same_classification(examples):
-        return examples[0]["classification"]
-    elif not attributes:
-        return plurality_value(examples)
-    else:
-        imp = [importance_function(a, examples) for a in attributes]
-        A = attributes[imp.index(max(imp))]  # essentially like argmax
-        tree = DecisionTree(attr=A)
-        for vk in get_attribute_values(A, examples):
-            exs = [e for e in examples if e.get(A) == vk]
+
+    # Rather than recursing, nodes still to be learned are kept on a stack.
+    # Each entry holds the tree and branch value the node is to be attached
+    # to (None for the root), its examples and the remaining attributes.
+    root = None
+    work = [(None, None, examples, attributes)]
+    while work:
+        parent, vk, examples, attributes = work.pop()
+        if examples_have_same_classification(examples):
+            tree = examples[0]["classification"]
+        elif not attributes:
+            tree = plurality_value(examples)
+        else:
+            # argmax in a single pass. Importances equal up to rounding are
+            # ties and kept by the first attribute, so that which of them is
+            # chosen does not depend on the order the sums were taken in.
+            A, best = None, None
+            for a in attributes:
+                importance = importance_function(a, examples)
+                if best is None or importance > best + TIE_TOLERANCE:
+                    A, best = a, importance
+            tree = DecisionTree(attr=A)
             att = [a for a in attributes if a != A]
-            subtree = decision_tree_learning(exs, att, examples,
-                                             importance_function)
-            tree.add_branch(vk=vk, subtree=subtree)
+            # pushed in reverse so that branches are added in the same order
+            # as they would be when recursing
+            for vk_, exs in reversed(list(partition(A, examples).items())):
+                work.append((tree, vk_, exs, att))
 
-    return tree
+        if parent is None:
+            root = tree
+        else:
+            parent.add_branch(vk=vk, subtree=tree)
 
+    return root
 
 
 def multiclass_decision_tree_learning(examples: list, attributes: list,
                                       parent_examples: list, classes: list):
     """
     Decision tree learning algorithm as given in figure 18.5 in Artificial
-    Intelligence A Modern Approach.
+    Intelligence A Modern Approach, for any number of classes. This is
+    decision_tree_learning with generalised_entropy_importance as the
+    importance function.
 
     :param examples: list of dictionaries containing examples to learn from
     :param attributes: list of all attributes in the examples
     :param parent_examples: list of all parent examples (can be the same as
         `examples` when first running)
-    :param importance_function: function that takes an attribute (str) and a
-        list of examples and returns a number representing the importance of
-        that attribute
+    :param classes: list of all classifications
     :return: DecisionTree, a decision tree
     """
+    def importance_function(attr, examples):
+        return generalised_entropy_importance(attr, examples, classes)
+
+    return decision_tree_learning(examples, attributes, parent_examples,
+                                  importance_function)
 
-    if not examples:
-        return plurality_value(parent_examples)
-    elif examples_have_same_classification(examples):
-        return examples[0]["classification"]
-    elif not attributes:
-        return plurality_value(examples)
-    else:
-        imp = [generalised_entropy_importance(a, examples, classes) for a in attributes]
-        A = attributes[imp.index(max(imp))]  # essentially like argmax
-        tree = DecisionTree(attr=A)
-        for vk in get_attribute_values(A, examples):
-            exs = [e for e in examples if e.get(A) == vk]
-            att = [a for a in attributes if a != A]
-            subtree = multiclass_decision_tree_learning(exs, att, examples, classes)
-            tree.add_branch(vk=vk, subtree=subtree)
 
-    return tree
+def columnar_decision_tree_learning(data, attributes=None, idx=None):
+    """
+    The same decision tree learning algorithm as decision_tree_learning,
+    using entropy as importance, but working on the integer coded columns of
+    the data (see parser.Data.columns) and arrays of example indices instead
+    of lists of example dictionaries. Any number of classes is supported.
+    Ties are broken by the same rules: between attributes by the order of
+    attributes (see TIE_TOLERANCE), and between classes by plurality_value's
+    rule, the class seen first among idx. Where rounding used to decide a
+    tie between attributes, the trees learned (and so the curve of
+    restaurant_learning_curve_plot) can differ from those learned before.
+
+    :param data: parser.Data to learn from
+    :param attributes: list of attributes to consider, by default all but
+        "classification"
+    :param idx: array of indices of the examples in data to learn from, by
+        default all of them. May contain repeats, e.g. a bootstrap sample.
+    :return: DecisionTree, a decision tree (or just the classification if
+        all examples have the same one)
+    """
+    if attributes is None:
+        attributes = [a for a in data.attributes if a != "classification"]
+    if idx is None:
+        idx = np.arange(len(data.examples))
+    if not len(idx):
+        raise ValueError("No examples to learn from")
+
+    columns, categories = data.columns()
+    classes = categories["classification"]
+    y = columns["classification"]
+    n_values = [len(categories[a]) for a in attributes]
+    # Stored column by column (Fortran order) in the narrowest integer type
+    # that holds the codes, usually a single byte. Every split reads whole
+    # columns, which are then contiguous and take up few cache lines.
+    X = np.empty((len(y), len(attributes)), order='F',
+                 dtype=np.min_scalar_type(max(n_values, default=1) - 1))
+    for j, a in enumerate(attributes):
+        X[:, j] = columns[a]
+    xlog2x = xlog2x_table(len(idx))
+
+    # As in decision_tree_learning, nodes still to be learned are kept on a
+    # stack along with the tree and branch value to attach them to. counts
+    # holds the number of examples of each class among idx; for all but the
+    # root it is a row of the parent's contingency table. The attributes
+    # still to be considered are a bitmask over the columns of X, so that
+    # removing the one split on is a single operation.
+    root = None
+    work = [(None, None, idx, (1 << len(attributes)) - 1,
+             np.bincount(y[idx], minlength=len(classes)))]
+    while work:
+        parent, vk, idx, candidates, counts = work.pop()
+        if np.count_nonzero(counts) == 1 or not candidates:
+            # as in plurality_value, a tie goes to the class seen first
+            top = np.flatnonzero(counts == counts.max())
+            if len(top) > 1:
+                top = y[idx][np.isin(y[idx], top)]
+            tree = classes[top[0]]
+        else:
+            a, table = best_split(X, y, idx, candidates, n_values,
+                                  len(classes), xlog2x)
+            A = attributes[a]
+            tree = DecisionTree(attr=A)
+            remaining = candidates & ~(1 << a)
+            # A stable sort of the examples by their value of A puts the
+            # examples of each branch next to each other, in their original
+            # order, so each branch gets a slice (a view) of the sorted
+            # indices. Their bounds follow from the sizes in the table.
+            idx = idx[np.argsort(X[idx, a], kind='stable')]
+            sizes = table.sum(axis=1)
+            ends = np.cumsum(sizes)
+            # pushed in reverse so that branches are added in code order
+            for code in reversed(range(len(table))):
+                if sizes[code]:
+                    work.append((tree, categories[A][code],
+                                 idx[ends[code] - sizes[code]:ends[code]],
+                                 remaining, table[code]))
+
+        if parent is None:
+            root = tree
+        else:
+            parent.add_branch(vk=vk, subtree=tree)
+
+    return root
 
 
 def tree_performance(tree, data):
-    correct = 0
-    skipped = 0
-    for e in data.examples:
-        try:
-            correct += tree.eval(e) == e["classification"]
-        except ValueError:
-            # found an example with an attribute value that hasn't been seen
-            # by the tree
-            skipped += 1
-        except AttributeError:
-            # tree likely built with all equal classifications, will naively
-            # classify everything as one classification
-            correct += tree == e["classification"]
-
-    return correct / (len(data.examples))
+    """
+    The fraction of the examples in data that a tree classifies correctly.
+    Examples with an attribute value the tree has not seen count as
+    incorrect.
+
+    :param tree: DecisionTree, or just a classification (if the examples
+        it was learned from all had the same one)
+    :param data: parser.Data with the examples to classify
+    :return: fraction of correctly classified examples
+    """
+    if not isinstance(tree, DecisionTree):
+        # tree built with all equal classifications, will naively classify
+        # everything as one classification
+        return sum(tree == e["classification"]
+                   for e in data.examples) / len(data.examples)
+
+    # All the examples are classified at once, as integer codes. Those
+    # without a branch for one of their values (-1), or classified as
+    # something data has no code for (-2), match no classification.
+    columns, categories = data.columns()
+    predictions = tree.compile(categories).eval_batch(columns)
+    return np.count_nonzero(predictions == columns["classification"]) / \
+        len(data.examples)
 
 
 def restaurant_learning_curve_plot():
@@ -289,14 +762,6 @@ def restaurant_learning_curve_plot():
     attributes = list(data.attributes.keys())
     attributes = [a for a in attributes if a != "classification"]
 
-    def get_bootstrap_dataset(data, n_examples):
-        idx = randint(0, len(data.examples), n_examples)
-        examples = [data.examples[i] for i in idx]
-        attrs = set()
-        for e in examples:
-            attrs.intersection_update(e.keys())
-        return parser.Data("subset", attrs, examples)
-
     navg = 20
     results = list()
     sizes = range(1, 101)
@@ -304,10 +769,10 @@ def restaurant_learning_curve_plot():
 
         avg = 0
         for _ in range(navg):  # averaged across 20 trials
-            train = get_bootstrap_dataset(data, n_examples=training_set_size)
+            # a bootstrap sample, as indices into the integer coded columns
+            train = randint(0, len(data.examples), training_set_size)
 
-            tree = decision_tree_learning(train.examples, attributes,
-                                          train.examples, entropy_importance)
+            tree = columnar_decision_tree_learning(data, attributes, train)
             avg += tree_performance(tree, data)
 
         results.append(avg / navg)
@@ -340,7 +805,7 @@ def test_using_restaurant_example_multiclass():
     attributes = [a for a in attributes if a != "classification"]
 
     tree = multiclass_decision_tree_learning(data.examples, attributes,
-                                             data.examples, classes=["Yes", "No"])
+                                             data.examples, classes=[YES, NO])
     print(tree)
     print(tree_performance(tree, data))
 
@@ -1,3 +1,5 @@
+import functools
+import io
 import sys
 import os.path
 
@@ -5,51 +7,111 @@ sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 
 from unittest import TestCase
 import unittest
-from decision_trees.parser import Parser, Lexer
+from decision_trees.parser import Parser, Lexer, parse
+
+
+@functools.lru_cache(maxsize=None)
+def load_tokens(file):
+    """
+    The tokens of a file, lexed only once however many tests use them.
+    A tuple, so that they can be gone through more than once.
+    """
+    with open(file, 'r') as f:
+        return tuple(Lexer.tokenize(f.read()))
 
 
 class TestParser(TestCase):
 
     def test_the_lexer(self):
-        with open('data/contact-lenses.arff', 'r') as f:
-            test = f.read()
-            # since tokenize is a generator, we must convert to list
-            # to be able to go through it more than once
-            tokens = list(Lexer.tokenize(test))
-            # for t in tokens:
-            #    print(t)
-            rels = filter(lambda t: t.typ == 'RELATION_DECL', tokens)
-            self.assertEqual(1, len(list(rels)))
-            attrs = filter(lambda t: t.typ == 'ATTR_DECL', tokens)
-            self.assertEqual(5, len(list(attrs)))
-            datas = filter(lambda t: t.typ == 'DATA_DECL', tokens)
-            self.assertEqual(1, len(list(datas)))
+        tokens = load_tokens('data/contact-lenses.arff')
+        rels = filter(lambda t: t.typ == 'RELATION_DECL', tokens)
+        self.assertEqual(1, len(list(rels)))
+        attrs = filter(lambda t: t.typ == 'ATTR_DECL', tokens)
+        self.assertEqual(5, len(list(attrs)))
+        datas = filter(lambda t: t.typ == 'DATA_DECL', tokens)
+        self.assertEqual(1, len(list(datas)))
 
     def test_contact_lenses_parsing(self):
-        with open('data/contact-lenses.arff', 'r') as f:
-            s = f.read()
-            parser = Parser(Lexer.tokenize(s))
-            parser.parse()
+        parser = Parser(iter(load_tokens('data/contact-lenses.arff')))
+        parser.parse()
 
     def test_restaurant_lexing(self):
-        with open('data/restaurant.arff', 'r') as f:
-            s = f.read()
-            tokens = list(Lexer.tokenize(s))
-            rels = filter(lambda t: t.typ == 'RELATION_DECL', tokens)
-            self.assertEqual(1, len(list(rels)))
-            attrs = filter(lambda t: t.typ == 'ATTR_DECL', tokens)
-            self.assertEqual(11, len(list(attrs)))
-            datas = filter(lambda t: t.typ == 'DATA_DECL', tokens)
-            self.assertEqual(1, len(list(datas)))
+        tokens = load_tokens('data/restaurant.arff')
+        rels = filter(lambda t: t.typ == 'RELATION_DECL', tokens)
+        self.assertEqual(1, len(list(rels)))
+        attrs = filter(lambda t: t.typ == 'ATTR_DECL', tokens)
+        self.assertEqual(11, len(list(attrs)))
+        datas = filter(lambda t: t.typ == 'DATA_DECL', tokens)
+        self.assertEqual(1, len(list(datas)))
 
     def test_restaurant_parsing(self):
-        # since the lexer returns a generator, we cannot
-        # iterate through it more than once, thus cannot test
-        # both lexing and parsing at the same time
+        # the parser takes an iterator, which is made from the cached tokens
+        # so that they are shared with the lexing test
+        parser = Parser(iter(load_tokens('data/restaurant.arff')))
+        parser.parse()
+
+    def test_lexing_trailing_whitespace(self):
+        # long runs of whitespace after the last token of a line are skipped
+        # (lexing this used to take over a minute, as they were rescanned
+        # from every position)
+        s = 'abc, def' + ' ' * 20000 + '\n' + 'ghi' + ' \t' * 5000
+        tokens = list(Lexer.tokenize(s))
+        self.assertEqual(['abc', ',', 'def', 'ghi'],
+                         [t.value for t in tokens])
+        self.assertEqual([1, 1, 1, 2], [t.line for t in tokens])
+
+    def test_data_section_from_lines(self):
+        # reading the data section directly from the lines should give the
+        # same examples as tokenising it
         with open('data/restaurant.arff', 'r') as f:
             s = f.read()
-            parser = Parser(Lexer.tokenize(s))
-            parser.parse()
+        from_tokens = Parser(iter(load_tokens('data/restaurant.arff'))).parse()
+        lines = Lexer.Lines(io.StringIO(s))
+        from_lines = Parser(Lexer.tokenize_stream(lines), lines).parse()
+        self.assertEqual(from_tokens.examples, from_lines.examples)
+        self.assertEqual(12, len(from_lines.examples))
+        # the lines must be the ones the tokens are read from
+        with self.assertRaises(TypeError):
+            Parser(Lexer.tokenize_stream(s.splitlines()), s.splitlines())
+        with self.assertRaises(RuntimeError):
+            Parser(Lexer.tokenize(s), Lexer.Lines(s.splitlines())).parse()
+
+    def test_data_on_the_data_decl_line(self):
+        header = ('@relation r\n@attribute a {x, y}\n'
+                  '@attribute classification {Yes, No}\n')
+        for data, expected in [
+                ('@data x,Yes\ny,No\n', [('x', 'Yes'), ('y', 'No')]),
+                ('@data % comment\nx, ?\n', [('x', None)]),
+                ('@data\n?,No', [(None, 'No')])]:
+            s = header + data
+            lines = Lexer.Lines(io.StringIO(s))
+            for parser in [Parser(Lexer.tokenize(s)),
+                           Parser(Lexer.tokenize_stream(lines), lines)]:
+                self.assertEqual(
+                    expected,
+                    [(e['a'], e['classification'])
+                     for e in parser.parse().examples])
+        for data in ['@data !\n', '@data x,Yes,\n', '@data x,?Yes\n']:
+            s = header + data
+            lines = Lexer.Lines(io.StringIO(s))
+            for parser in [Parser(Lexer.tokenize(s)),
+                           Parser(Lexer.tokenize_stream(lines), lines)]:
+                with self.assertRaises(RuntimeError):
+                    parser.parse()
+
+    def test_data_columns(self):
+        data = parse('data/restaurant.arff')
+        columns, categories = data.columns()
+        self.assertEqual(set(data.attributes), set(columns))
+        for attr, column in columns.items():
+            self.assertEqual(
+                [categories[attr][code] for code in column],
+                [e[attr] for e in data.examples])
+        # declared values come first, in declaration order
+        self.assertEqual(data.attributes['classification'],
+                         categories['classification'][:2])
+        # worked out once
+        self.assertIs(data.columns()[0], columns)
 
 if __name__ == '__main__':
     unittest.main()
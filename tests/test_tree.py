@@ -1,10 +1,12 @@
 import sys
 import os.path
+import warnings
 
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 
 from unittest import TestCase
 import unittest
+import numpy as np
 from decision_trees import tree
 from decision_trees import parser
 
@@ -33,6 +35,17 @@ class TestDecisionTree(TestCase):
         self.assertEqual(root_tree.eval(example3), "Yes")
         self.assertEqual(root_tree.eval(example4), "No")
 
+    def test_subtree_subclass(self):
+        class Subtree(tree.DecisionTree):
+            pass
+
+        sub = Subtree(attr="Hungry")
+        sub.add_branch("Yes", "Yes")
+        root_tree = tree.DecisionTree(attr="Patrons")
+        root_tree.add_branch("Full", sub)
+        self.assertEqual(
+            root_tree.eval({"Patrons": "Full", "Hungry": "Yes"}), "Yes")
+
     def test_examples_have_same_classification_function(self):
         ex1 = {"Patrons": "None", "Hungry": "Yes", "classification": "No"}
         ex2 = {"Patrons": "Some", "Hungry": "Yes", "classification": "Yes"}
@@ -57,6 +70,9 @@ class TestDecisionTree(TestCase):
         l2 = [ex1, ex2, ex3, ex7]
         self.assertEqual(tree.plurality_value(l1), "No")
         self.assertEqual(tree.plurality_value(l2), "Yes")
+        # ties go to the class seen first
+        self.assertEqual(tree.plurality_value([ex1, ex2]), "No")
+        self.assertEqual(tree.plurality_value([ex2, ex1]), "Yes")
 
     def test_get_attribute_values(self):
         ex1 = {"Patrons": "None", "Hungry": "Yes", "classification": "No"}
@@ -72,6 +88,17 @@ class TestDecisionTree(TestCase):
         self.assertEqual(tree.get_attribute_values("Hungry", examples),
                          {"No", "Yes"})
 
+    def test_partition(self):
+        ex1 = {"Patrons": "None", "Hungry": "Yes", "classification": "No"}
+        ex2 = {"Patrons": "Some", "Hungry": "Yes", "classification": "Yes"}
+        ex3 = {"Patrons": "Full", "Hungry": "Yes", "classification": "Yes"}
+        ex4 = {"Patrons": "Full", "Hungry": "No", "classification": "No"}
+
+        examples = [ex1, ex2, ex3, ex4]
+
+        self.assertEqual(tree.partition("Patrons", examples),
+                         {"None": [ex1], "Some": [ex2], "Full": [ex3, ex4]})
+
     def test_decision_tree_learning_algorithm_order_1(self):
         ex1 = {"Patrons": "None", "Hungry": "Yes", "classification": "No"}
         ex2 = {"Patrons": "Some", "Hungry": "Yes", "classification": "Yes"}
@@ -116,6 +143,21 @@ class TestDecisionTree(TestCase):
         self.assertEqual(t.eval(ex3), "Yes")
         self.assertEqual(t.eval(ex4), "No")
 
+    def test_decision_tree_learning_ties_go_to_first_attribute(self):
+        ex1 = {"Patrons": "None", "Hungry": "Yes", "classification": "No"}
+        ex2 = {"Patrons": "Some", "Hungry": "No", "classification": "Yes"}
+        examples = [ex1, ex2]
+
+        # importances equal but for rounding noise in the last place
+        def importance(attr, examples):
+            return {"Patrons": 0.3602297178607611,
+                    "Hungry": 0.3602297178607612}[attr]
+
+        for attributes in (["Patrons", "Hungry"], ["Hungry", "Patrons"]):
+            t = tree.decision_tree_learning(examples, attributes, examples,
+                                            importance)
+            self.assertEqual(t.attr, attributes[0])
+
     def test_binary_entropy_function(self):
         self.assertEqual(tree.B(0.5), 1)
         self.assertAlmostEqual(tree.B(0.99), 0.0807931358959)
@@ -143,7 +185,7 @@ class TestDecisionTree(TestCase):
             importance_function=tree.entropy_importance
         )
 
-        self.assertTrue(str(tree1) == str(tree2))
+        self.assertEqual(tree1.canonical(), tree2.canonical())
 
     def test_entropy_importance_on_book_example(self):
         data = parser.parse("data/restaurant.arff")
@@ -183,6 +225,21 @@ class TestDecisionTree(TestCase):
             0
         )
 
+    def test_gini_importance_on_book_example(self):
+        data = parser.parse("data/restaurant.arff")
+
+        # 1/2 to begin with, 1/2 * 4/9 left in Full
+        self.assertAlmostEqual(
+            tree.gini_importance("Patrons", data.examples), 5 / 18)
+
+        self.assertAlmostEqual(
+            tree.gini_importance("Type", data.examples), 0)
+
+        t = tree.decision_tree_learning(
+            data.examples, ["Type", "Patrons", "Hungry"], data.examples,
+            tree.gini_importance)
+        self.assertEqual(t.attr, "Patrons")
+
     def test_B(self):
         # loaded coin
         self.assertAlmostEqual(tree.B(0.99), 0.08, places=2)
@@ -200,12 +257,114 @@ class TestDecisionTree(TestCase):
         for example in data.examples:
             classification = example['classification']
             self.assertEqual(d_tree.eval(example), classification)
+        # and all at once, integer coded
+        columns, categories = data.columns()
+        self.assertEqual(
+            list(d_tree.compile(categories).eval_batch(columns)),
+            list(columns['classification']))
+
+    def test_eval_batch(self):
+        data = parser.parse("data/restaurant.arff")
+        attributes = list(data.attributes.keys())
+        attrs = [a for a in attributes if a != "classification"]
+        d_tree = tree.decision_tree_learning(
+            data.examples, attrs,
+            data.examples,
+            importance_function=tree.entropy_importance)
+        self.assertEqual(d_tree.eval_batch(data.examples),
+                         [d_tree.eval(e) for e in data.examples])
+        with self.assertRaises(ValueError):
+            d_tree.eval_batch([{a: "unseen" for a in attrs}])
+
+    def test_compile_eval(self):
+        data = parser.parse("data/restaurant.arff")
+        d_tree = tree.columnar_decision_tree_learning(data)
+        compiled = d_tree.compile_eval()
+        for example in data.examples:
+            self.assertEqual(compiled(example), d_tree.eval(example))
+        with self.assertRaises(ValueError):
+            compiled({a: "unseen" for a in data.attributes})
+
+        # a chain deeper than both the nesting and the recursion limits,
+        # with values that are not str literals
+        depth = 2000
+        root_tree = node = tree.DecisionTree(attr="a0")
+        for i in range(1, depth):
+            sub = tree.DecisionTree(attr="a%d" % i)
+            node.add_branch(np.str_("x"), "No")
+            node.add_branch(np.str_("y"), sub)
+            node = sub
+        node.add_branch(np.str_("y"), "Yes")
+        compiled = root_tree.compile_eval()
+        example = {"a%d" % i: "y" for i in range(depth)}
+        self.assertEqual(compiled(example), "Yes")
+        example["a1500"] = "x"
+        self.assertEqual(compiled(example), "No")
+        canonical = root_tree.canonical()
+        for i in range(depth - 1):
+            self.assertEqual(canonical[0], "a%d" % i)
+            self.assertEqual(canonical[1][0], ("x", "No"))
+            canonical = canonical[1][1][1]
+        self.assertEqual(canonical, ("a%d" % (depth - 1), (("y", "Yes"),)))
+
+    def test_compiled_tree(self):
+        data = parser.parse("data/restaurant.arff")
+        columns, categories = data.columns()
+        d_tree = tree.columnar_decision_tree_learning(data)
+        classes = categories["classification"]
+        compiled = d_tree.compile(categories)
+        self.assertEqual(
+            [classes[c] for c in compiled.eval_batch(columns)],
+            [d_tree.eval(e) for e in data.examples])
+        # a tree without a branch for a value classifies its examples as -1
+        d_tree = tree.DecisionTree(attr="Patrons")
+        d_tree.add_branch("Some", "Yes")
+        d_tree.add_branch("Full", "No")
+        self.assertEqual(
+            list(d_tree.compile(categories).eval_batch(columns)),
+            [{"Some": classes.index("Yes"), "Full": classes.index("No"),
+              "None": -1}[e["Patrons"]] for e in data.examples])
+
+    def test_tree_performance(self):
+        data = parser.parse("data/restaurant.arff")
+        d_tree = tree.columnar_decision_tree_learning(data)
+        self.assertEqual(tree.tree_performance(d_tree, data), 1)
+        # half of the restaurant examples are "Yes"
+        self.assertEqual(tree.tree_performance("Yes", data), 0.5)
+        # examples with a value without a branch count as incorrect
+        d_tree = tree.DecisionTree(attr="Patrons")
+        d_tree.add_branch("Some", "Yes")
+        self.assertEqual(tree.tree_performance(d_tree, data), 4 / 12)
+        # as do those classified as something not in the data
+        d_tree.add_branch("None", "Maybe")
+        d_tree.add_branch("Full", "No")
+        self.assertEqual(tree.tree_performance(d_tree, data), 8 / 12)
+
+    def test_columnar_decision_tree_learning(self):
+        for file in ["data/restaurant.arff", "data/contact-lenses.arff"]:
+            data = parser.parse(file)
+            d_tree = tree.columnar_decision_tree_learning(data)
+            for example in data.examples:
+                self.assertEqual(d_tree.eval(example),
+                                 example['classification'])
+        # with no attributes to split on, a tie goes to the class seen first
+        for idx in ([0, 1], [1, 0]):
+            self.assertEqual(
+                tree.columnar_decision_tree_learning(data, [], np.array(idx)),
+                data.examples[idx[0]]["classification"])
+        with self.assertRaises(ValueError):
+            tree.columnar_decision_tree_learning(data, idx=np.arange(0))
 
     def test_should_prune(self):
         data = parser.parse("data/restaurant.arff")
         attributes = list(data.attributes.keys())
         for a in [a for a in attributes if a != "classification"]:
             tree.should_prune(a, data.examples)
+        # with a single class no attribute can matter
+        yes_only = [e for e in data.examples if e["classification"] == "Yes"]
+        with warnings.catch_warnings():
+            warnings.simplefilter("error")
+            self.assertTrue(tree.should_prune("Patrons", yes_only))
 
 
 if __name__ == '__main__':